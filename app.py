@@ -1,15 +1,140 @@
 import os
+import gzip
 import time
-import requests
+import base64
+import random
+import hashlib
+import ssl
+import asyncio
+import httpx
+import orjson
+from collections import OrderedDict, deque
+from dataclasses import dataclass
 from io import BytesIO
-from flask import Flask, request, send_file, Response
+from urllib.parse import urlsplit
+from quart import Quart, request, send_file, Response
 
-app = Flask(__name__)
+app = Quart(__name__)
 
 # --- Configuration ---
 DO_API_TOKEN = os.getenv("DO_API_TOKEN")  # set this in environment
 DO_URL = "https://inference.do-ai.run/v1/async-invoke"
-MODEL_ID = "fal-ai/fast-sdxl"
+# Hot-path URLs are built from templates instead of re-assembling f-strings
+# on every poll iteration.
+STATUS_URL_TPL = DO_URL + "/{}/status"
+RESULT_URL_TPL = DO_URL + "/{}"
+MODEL_ID = os.getenv("MODEL_ID", "fal-ai/fast-sdxl")
+# Polling backoff: start fast (short jobs return sub-second), grow
+# geometrically, cap at POLL_MAX. Jitter avoids synchronized polls under load.
+POLL_START = float(os.getenv("POLL_START", "0.3"))
+POLL_MULT = float(os.getenv("POLL_MULT", "1.5"))
+POLL_MAX = float(os.getenv("POLL_MAX", "5.0"))
+POLL_JITTER = float(os.getenv("POLL_JITTER", "0.1"))
+POLL_TIMEOUT = float(os.getenv("POLL_TIMEOUT", "60"))  # give up after this many seconds
+# Result images come from fal's CDN; warming a connection there while the job
+# is still running hides the image fetch's DNS+TCP+TLS setup behind the poll.
+IMG_WARM_URL = os.getenv("IMG_WARM_URL", "https://fal.media/")
+
+# Repeat prompts skip the whole inference call: finished images are kept
+# in-process keyed by (model, prompt) for CACHE_TTL_SEC, bounded at
+# CACHE_MAX_ENTRIES with least-recently-used eviction so unique-prompt
+# traffic can't grow memory without limit.
+CACHE_TTL_SEC = float(os.getenv("CACHE_TTL_SEC", "86400"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "128"))
+IMAGE_CACHE = OrderedDict()  # key -> (expires_at, img_bytes, mime), oldest first
+
+def cache_key(model_id, prompt):
+    return hashlib.sha256(f"{model_id}\0{prompt}".encode()).hexdigest()
+
+def cache_get(key):
+    entry = IMAGE_CACHE.get(key)
+    if entry is None:
+        return None
+    expires_at, img_bytes, mime = entry
+    if expires_at < time.monotonic():
+        IMAGE_CACHE.pop(key, None)
+        return None
+    IMAGE_CACHE.move_to_end(key)
+    return img_bytes, mime
+
+def cache_put(key, img_bytes, mime):
+    IMAGE_CACHE[key] = (time.monotonic() + CACHE_TTL_SEC, img_bytes, mime)
+    IMAGE_CACHE.move_to_end(key)
+    while len(IMAGE_CACHE) > CACHE_MAX_ENTRIES:
+        IMAGE_CACHE.popitem(last=False)
+
+HEADERS = {
+    "Authorization": f"Bearer {DO_API_TOKEN}",
+    "Content-Type": "application/json"
+}
+
+# Shared clients so the polling loop reuses keep-alive connections instead of
+# paying a fresh TCP+TLS handshake on every call. HTTP/2 additionally
+# multiplexes concurrent polls over one stream. Created on the running event
+# loop, hence before_serving.
+CLIENT = None
+IMG_CLIENT = None
+POLLER_TASK = None
+
+# One TLS context for both clients: built once instead of per client, and its
+# shared session cache lets reconnects resume TLS sessions rather than redo
+# the full handshake.
+SSL_CONTEXT = ssl.create_default_context()
+
+LIMITS = httpx.Limits(
+    max_connections=64,
+    max_keepalive_connections=32,
+    keepalive_expiry=75,
+)
+
+def _make_client(**kwargs):
+    # Connect-level retries live on the transport; http2/TLS/pool settings
+    # move there too since an explicit transport bypasses the client's own.
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(30.0),
+        transport=httpx.AsyncHTTPTransport(
+            http2=True,
+            verify=SSL_CONTEXT,
+            limits=LIMITS,
+            retries=3,
+        ),
+        **kwargs,
+    )
+
+async def _warm(client, url):
+    # Pre-open DNS/TCP/TLS so the first real request skips the handshake.
+    # Best-effort: a failure here just means a cold first request.
+    try:
+        await client.head(url, timeout=5)
+    except Exception:
+        pass
+
+async def _preresolve(url):
+    # Touch the resolver for a host once at startup so any local DNS cache
+    # (systemd-resolved, nscd) is hot before connections open; reconnects
+    # after keepalive expiry then skip the 5-50ms lookup too. Best-effort.
+    try:
+        loop = asyncio.get_running_loop()
+        await loop.getaddrinfo(urlsplit(url).hostname, 443)
+    except OSError:
+        pass
+
+@app.before_serving
+async def _open_clients():
+    global CLIENT, IMG_CLIENT, POLLER_TASK
+    CLIENT = _make_client(headers=HEADERS)
+    # Result images live on a different host than the inference API, so they
+    # get their own pool (no auth headers either).
+    IMG_CLIENT = _make_client()
+    POLLER_TASK = asyncio.create_task(poller_loop())
+    asyncio.create_task(_preresolve(IMG_WARM_URL))
+    asyncio.create_task(_warm(CLIENT, "https://inference.do-ai.run/"))
+
+@app.after_serving
+async def _close_clients():
+    POLLER_TASK.cancel()
+    await CLIENT.aclose()
+    await IMG_CLIENT.aclose()
 
 # Simple HTML UI
 HTML = """
@@ -27,7 +152,7 @@ HTML = """
     </style>
   </head>
   <body>
-    <h2>Text → Image using fal-ai/fast-sdxl (DigitalOcean)</h2>
+    <h2>Text → Image using __MODEL_ID__ (DigitalOcean)</h2>
     <textarea id="prompt" placeholder="Enter your prompt here..."></textarea><br>
     <button onclick="generate()">Generate</button>
     <div id="status"></div>
@@ -59,57 +184,340 @@ HTML = """
     </script>
   </body>
 </html>
-"""
+""".replace("__MODEL_ID__", MODEL_ID)
 
-@app.route("/")
-def index():
-    return Response(HTML, mimetype="text/html")
+# The landing page never changes at runtime: compress it once at import and
+# let warm clients revalidate with an ETag instead of redownloading. Each
+# encoding variant carries its own tag so an intermediary can't conflate them.
+HTML_GZ = gzip.compress(HTML.encode("utf-8"), compresslevel=9)
+HTML_ETAG = hashlib.md5(HTML.encode("utf-8")).hexdigest()
+HTML_ETAG_GZ = HTML_ETAG + "-gz"
+INDEX_CACHE_CONTROL = "public, max-age=3600"
 
-@app.route("/generate", methods=["POST"])
-def generate():
-    data = request.get_json()
-    prompt = data.get("prompt", "").strip()
-    if not prompt:
-        return "Prompt required", 400
+def _json(resp):
+    # orjson parses straight from bytes, skipping the intermediate str the
+    # stdlib decoder would build for every poll response.
+    return orjson.loads(resp.content)
 
-    headers = {
-        "Authorization": f"Bearer {DO_API_TOKEN}",
-        "Content-Type": "application/json"
-    }
+RETRY_TOTAL = 4
+RETRY_BACKOFF = 0.5
+RETRY_STATUS = frozenset({429, 500, 502, 503, 504})
+
+async def _api_request(method, url, **kwargs):
+    """Issue an API request, retrying transient failures with backoff.
 
+    A transient 502/503 used to surface to the user after a full minute of
+    waiting, throwing away the whole inference. Transport-level connect
+    retries are handled by the client; this covers dropped reads and the
+    retryable status codes, honoring Retry-After when the server sends one.
+    """
+    delay = RETRY_BACKOFF
+    for attempt in range(RETRY_TOTAL):
+        try:
+            resp = await CLIENT.request(method, url, **kwargs)
+        except httpx.TransportError:
+            if attempt == RETRY_TOTAL - 1:
+                raise
+        else:
+            if resp.status_code not in RETRY_STATUS or attempt == RETRY_TOTAL - 1:
+                resp.raise_for_status()
+                return resp
+            retry_after = resp.headers.get("Retry-After", "")
+            if retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+        await asyncio.sleep(delay)
+        delay *= 2
+
+async def start_async_invoke(prompt):
     payload = {
         "model_id": MODEL_ID,
         "input": {"prompt": prompt}
     }
+    resp = await _api_request("POST", DO_URL, content=orjson.dumps(payload), timeout=20)
+    return _json(resp)
+
+@dataclass(slots=True)
+class InferenceJob:
+    """Per-generation polling state, URLs prebuilt once at submit time."""
+    rid: str
+    status_url: str
+    result_url: str
+    event: asyncio.Event
+    attempt: int = 0
+    next_due: float = 0.0
+    warmed: bool = False
 
+def make_job(rid):
+    return InferenceJob(
+        rid,
+        STATUS_URL_TPL.format(rid),
+        RESULT_URL_TPL.format(rid),
+        asyncio.Event(),
+        next_due=time.monotonic(),
+    )
+
+async def get_status(job):
+    return _json(await _api_request("GET", job.status_url, timeout=10))
+
+async def get_result(job):
+    return _json(await _api_request("GET", job.result_url, timeout=30))
+
+# One background loop polls every pending generation: N concurrent users cost
+# a single timer tick, and the due status checks fan out together over the
+# shared HTTP/2 stream. (DO exposes no multi-id status endpoint, otherwise the
+# tick would collapse into one batched request.)
+PENDING = {}  # request_id -> InferenceJob
+RESULTS = {}  # request_id -> result json, or the exception to re-raise
+POLL_TICK = 0.1  # how often the poller checks whether anything is due
+
+def _next_due(job):
+    job.attempt += 1
+    interval = min(POLL_MAX, POLL_START * (POLL_MULT ** job.attempt))
+    job.next_due = time.monotonic() + interval + random.uniform(0, POLL_JITTER)
+
+async def _check_job(job):
+    # Fail-to-retry throughout: the poller task is shared by every pending
+    # generation, so nothing here may escape into asyncio.gather and kill it
+    # — not even a 200 whose body isn't a JSON object.
     try:
-        # 1️⃣ Submit the job
-        resp = requests.post(DO_URL, headers=headers, json=payload, timeout=20)
-        resp.raise_for_status()
-        job = resp.json()
-        request_id = job.get("request_id") or job.get("id")
-        if not request_id:
-            return "Invalid response: no request_id", 500
-
-        # 2️⃣ Poll for result
-        for _ in range(30):
-            status = requests.get(f"{DO_URL}/{request_id}/status", headers=headers, timeout=10).json()
-            if status.get("status") in ("SUCCESS", "COMPLETE"):
-                break
-            time.sleep(2)
-
-        # 3️⃣ Fetch result
-        result = requests.get(f"{DO_URL}/{request_id}", headers=headers, timeout=30).json()
-        img_url = result.get("output", [{}])[0].get("url") or result.get("url")
-
-        if not img_url:
-            return "No image URL in result", 500
+        status = await get_status(job)
+        # Fast path: some models inline the result into the status body, so a
+        # separate get_result round-trip would be wasted.
+        if status.get("output") or status.get("url"):
+            result = status
+        elif status.get("status") in ("SUCCESS", "COMPLETE"):
+            try:
+                result = await get_result(job)
+            except Exception as e:
+                result = e
+        else:
+            # Still running: warm the image host once (near the end if the
+            # API reports progress, otherwise right away) so the pool already
+            # holds a live connection when the result URL arrives.
+            progress = status.get("progress")
+            if not job.warmed and (progress is None or progress >= 0.9):
+                job.warmed = True
+                asyncio.create_task(_warm(IMG_CLIENT, IMG_WARM_URL))
+            _next_due(job)
+            return
+    except Exception:
+        _next_due(job)
+        return
+    # Claim the waiter before publishing: if it already timed out or
+    # disconnected, drop the result rather than pinning it in RESULTS forever.
+    if PENDING.pop(job.rid, None):
+        RESULTS[job.rid] = result
+        job.event.set()
 
-        img_resp = requests.get(img_url, timeout=30)
+async def poller_loop():
+    while True:
+        await asyncio.sleep(POLL_TICK)
+        now = time.monotonic()
+        due = [job for job in PENDING.values() if job.next_due <= now]
+        if due:
+            await asyncio.gather(*(_check_job(job) for job in due))
+
+async def poll_until_complete(request_id):
+    job = make_job(request_id)
+    PENDING[request_id] = job
+    try:
+        await job.event.wait()
+        result = RESULTS[request_id]
+    finally:
+        # Clear both maps on every exit — timeout and disconnect included —
+        # so an abandoned job can't leave a stale entry behind.
+        PENDING.pop(request_id, None)
+        RESULTS.pop(request_id, None)
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+# Concurrent identical prompts share one inference: the first caller owns the
+# submit+poll task, later callers await the same one. This covers the window
+# the finished-result cache can't — the job is still running when the
+# duplicate arrives.
+INFLIGHT = {}  # cache key -> Task producing the result json
+
+async def run_inference(prompt):
+    job = await start_async_invoke(prompt)
+    request_id = job.get("request_id") or job.get("id")
+    if not request_id:
+        raise ValueError("Invalid response: no request_id")
+    return await asyncio.wait_for(poll_until_complete(request_id), timeout=POLL_TIMEOUT)
+
+def inference_task(key, prompt):
+    task = INFLIGHT.get(key)
+    if task is None:
+        task = asyncio.create_task(run_inference(prompt))
+        INFLIGHT[key] = task
+        task.add_done_callback(lambda _t: INFLIGHT.pop(key, None))
+    return task
+
+def find_url(obj):
+    """Breadth-first scan of a JSON payload for the first http(s) string.
+
+    Iterative on purpose: fal result bodies can nest deeply and a recursive
+    walk both re-enters Python frames per level and risks the recursion
+    limit on pathological responses.
+    """
+    dq = deque([obj])
+    while dq:
+        o = dq.popleft()
+        if isinstance(o, str):
+            if o.startswith(("http://", "https://")):
+                return o
+        elif isinstance(o, dict):
+            dq.extend(o.values())
+        elif isinstance(o, list):
+            dq.extend(o)
+    return None
+
+def extract_inline_image(result):
+    """Return (bytes, mime) when the result embeds the image as base64.
+
+    Inline results skip the whole image fetch; the payload is decoded once
+    (b64decode with the default validate=False goes straight to binascii, no
+    regex pass over the MB-scale string) and served as-is with no BytesIO
+    wrapper, so no second image-sized copy is made.
+    """
+    out = result.get("output")
+    item = out[0] if isinstance(out, list) and out else result
+    if not isinstance(item, dict):
+        return None, None
+    b64 = item.get("b64_json") or item.get("base64")
+    mime = item.get("content_type", "image/png")
+    if not b64:
+        url = item.get("url")
+        if isinstance(url, str) and url.startswith("data:"):
+            header, _, b64 = url.partition(",")
+            mime = header[5:].split(";")[0] or mime
+    if not b64:
+        return None, None
+    return base64.b64decode(b64), mime
+
+def _first_output(j):
+    out = j.get("output") or j.get("outputs") or j.get("results")
+    if isinstance(out, list) and out and isinstance(out[0], dict):
+        return out[0]
+    return None
+
+# Known result shapes, probed in order with the whole-body BFS scan as the
+# last resort. One tuple to maintain as new shapes show up.
+URL_PROBES = (
+    lambda j: (_first_output(j) or {}).get("url"),
+    lambda j: j.get("url"),
+    find_url,
+)
+
+def extract_image_url(result):
+    for probe in URL_PROBES:
+        url = probe(result)
+        if url:
+            return url
+    return None
+
+# Models with a known response shape get a specialized one-probe extractor
+# chosen once at import; anything else (or a shape change) falls back to the
+# full probe ladder.
+EXTRACTORS = {
+    "fal-ai/fast-sdxl": lambda j: (j.get("output") or [{}])[0].get("url"),
+    "fal-ai/flux/schnell": lambda j: (j.get("output") or [{}])[0].get("url"),
+}
+
+_MODEL_EXTRACTOR = EXTRACTORS.get(MODEL_ID)
+
+def extract_url(result):
+    if _MODEL_EXTRACTOR is not None:
+        try:
+            url = _MODEL_EXTRACTOR(result)
+        except (LookupError, AttributeError, TypeError):
+            # Shape drift (e.g. output as a list of strings or a dict):
+            # the probe ladder below handles those.
+            url = None
+        if url:
+            return url
+    return extract_image_url(result)
+
+async def open_image_stream(result):
+    """Open the result image for streaming; returns (response, mime).
+
+    The response stays open so callers can relay chunks as they arrive
+    instead of buffering the whole image in memory first.
+    """
+    img_url = extract_url(result)
+    if not img_url:
+        return None, None
+    img_req = IMG_CLIENT.build_request("GET", img_url, timeout=30)
+    img_resp = await IMG_CLIENT.send(img_req, stream=True)
+    try:
         img_resp.raise_for_status()
+    except Exception:
+        await img_resp.aclose()
+        raise
+    return img_resp, img_resp.headers.get("Content-Type", "image/png")
+
+@app.route("/")
+async def index():
+    gzip_ok = "gzip" in request.headers.get("Accept-Encoding", "")
+    headers = {
+        "ETag": HTML_ETAG_GZ if gzip_ok else HTML_ETAG,
+        "Cache-Control": INDEX_CACHE_CONTROL,
+        # The body is negotiated on Accept-Encoding, so shared caches must
+        # key on it too or they'd replay gzip to clients that can't take it.
+        "Vary": "Accept-Encoding",
+    }
+    if request.headers.get("If-None-Match") in (HTML_ETAG, HTML_ETAG_GZ):
+        return Response(b"", status=304, headers=headers)
+    if gzip_ok:
+        headers["Content-Encoding"] = "gzip"
+        return Response(HTML_GZ, mimetype="text/html", headers=headers)
+    return Response(HTML, mimetype="text/html", headers=headers)
+
+@app.route("/generate", methods=["POST"])
+async def generate():
+    data = await request.get_json()
+    prompt = data.get("prompt", "").strip()
+    if not prompt:
+        return "Prompt required", 400
+
+    key = cache_key(MODEL_ID, prompt)
+    cached = cache_get(key)
+    if cached is not None:
+        img_bytes, mime = cached
+        return await send_file(BytesIO(img_bytes), mimetype=mime)
+
+    try:
+        # 1️⃣+2️⃣ Submit and poll — shared with any concurrent identical prompt
+        result = await inference_task(key, prompt)
+
+        # 3️⃣ Inline base64 results need no second fetch at all
+        img_bytes, mime = extract_inline_image(result)
+        if img_bytes is not None:
+            cache_put(key, img_bytes, mime)
+            return Response(img_bytes, mimetype=mime)
+
+        # Otherwise stream the image through, overlapping download with send
+        img_resp, mime = await open_image_stream(result)
+        if img_resp is None:
+            return "No image URL in result", 500
+
+        async def relay():
+            chunks = []
+            try:
+                async for chunk in img_resp.aiter_bytes(64 * 1024):
+                    chunks.append(chunk)
+                    yield chunk
+                cache_put(key, b"".join(chunks), mime)
+            finally:
+                await img_resp.aclose()
 
-        return send_file(BytesIO(img_resp.content), mimetype=img_resp.headers.get("Content-Type", "image/png"))
+        headers = {}
+        if img_resp.headers.get("Content-Length"):
+            headers["Content-Length"] = img_resp.headers["Content-Length"]
+        return Response(relay(), mimetype=mime, headers=headers)
 
+    except asyncio.TimeoutError:
+        return "Timed out waiting for generation", 504
     except Exception as e:
         return f"Error: {e}", 500
 
@@ -0,0 +1,81 @@
+import os
+import time
+
+import httpx
+import streamlit as st
+
+# --- Configuration ---
+DO_API_TOKEN = os.getenv("DO_API_TOKEN")  # set this in environment
+DO_URL = "https://inference.do-ai.run/v1/async-invoke"
+MODEL_ID = os.getenv("MODEL_ID", "fal-ai/fast-sdxl")
+POLL_INTERVAL = 1.5
+POLL_TIMEOUT = float(os.getenv("POLL_TIMEOUT", "60"))
+
+HEADERS = {
+    "Authorization": f"Bearer {DO_API_TOKEN}",
+    "Content-Type": "application/json"
+}
+
+@st.cache_resource
+def get_client():
+    # One pooled client per server process; Streamlit reruns the script on
+    # every widget interaction, so this must not be rebuilt each run.
+    return httpx.Client(http2=True, headers=HEADERS, timeout=30)
+
+def start_async_invoke(client, model_id, prompt):
+    resp = client.post(DO_URL, json={"model_id": model_id, "input": {"prompt": prompt}})
+    resp.raise_for_status()
+    return resp.json()
+
+def poll_until_complete(client, request_id):
+    deadline = time.monotonic() + POLL_TIMEOUT
+    while time.monotonic() < deadline:
+        status = client.get(f"{DO_URL}/{request_id}/status").json()
+        if status.get("output") or status.get("url"):
+            return status
+        if status.get("status") in ("SUCCESS", "COMPLETE"):
+            return client.get(f"{DO_URL}/{request_id}").json()
+        time.sleep(POLL_INTERVAL)
+    raise TimeoutError("Timed out waiting for generation")
+
+def extract_first_image_bytes(client, result):
+    img_url = result.get("output", [{}])[0].get("url") or result.get("url")
+    if not img_url:
+        raise ValueError("No image URL in result")
+    img_resp = client.get(img_url)
+    img_resp.raise_for_status()
+    return img_resp.content, img_resp.headers.get("Content-Type", "image/png")
+
+@st.cache_data(ttl=3600, max_entries=128, show_spinner=False)
+def generate_cached(model_id, prompt):
+    """Run the whole submit→poll→fetch pipeline, memoized on (model, prompt).
+
+    Streamlit reruns the script top-to-bottom on every widget interaction;
+    without the cache each rerun would re-invoke a ~10s GPU inference for a
+    prompt that was just generated.
+    """
+    client = get_client()
+    job = start_async_invoke(client, model_id, prompt)
+    request_id = job.get("request_id") or job.get("id")
+    if not request_id:
+        raise ValueError("Invalid response: no request_id")
+    result = poll_until_complete(client, request_id)
+    return extract_first_image_bytes(client, result)
+
+st.title(f"Text → Image using {MODEL_ID} (DigitalOcean)")
+if not DO_API_TOKEN:
+    st.warning("Please set DO_API_TOKEN in your environment.")
+
+prompt = st.text_area("Prompt", placeholder="Enter your prompt here...")
+
+if st.button("Generate"):
+    prompt = prompt.strip()
+    if not prompt:
+        st.warning("Please enter a prompt.")
+    else:
+        with st.spinner("Generating image... (this may take ~10s)"):
+            try:
+                img_bytes, _mime = generate_cached(MODEL_ID, prompt)
+                st.image(img_bytes)
+            except Exception as e:
+                st.error(f"Error: {e}")